@@ -8,7 +8,8 @@ from langgraph.prebuilt import ToolNode
 from langchain_core.messages import BaseMessage, SystemMessage
 from langchain_groq import ChatGroq
 from langchain.tools import tool
-from app.backend.services.vector_db import VectorStoreManager
+from app.backend.services.vector_db import get_vector_store_manager
+from functools import lru_cache
 import operator
 
 
@@ -69,28 +70,39 @@ class AgentState(TypedDict):
 # TOOLS
 # ============================================================
 @tool
-def retrieve_documents(query: str) -> str:
+async def retrieve_documents(query: str) -> str:
     """
     Retrieve relevant chunks from the loaded documents based on the query.
     Uses hybrid search (BM25 + vector) for robust retrieval.
     """
-    manager = VectorStoreManager()
+    manager = get_vector_store_manager()
 
-    # Use hybrid search for better recall (combines keyword + semantic)
-    docs = manager.hybrid_search(query, k=6, vector_weight=0.5)
+    # Use hybrid search for better recall (combines keyword + semantic),
+    # running both retrievers concurrently
+    docs = await manager.ahybrid_search(query, k=6, vector_weight=0.5)
 
     if not docs:
         return "NO_RELEVANT_DOCUMENTS_FOUND"
 
-    context_str = ""
+    parts = []
     for doc in docs:
         page = doc.metadata.get("page", "?")
         source = doc.metadata.get("source", "Unknown")
-        context_str += (
+        parts.append(
             f"\n--- [Page {page}] (Source: {source}) ---\n{doc.page_content}\n"
         )
 
-    return context_str
+    return "".join(parts)
+
+
+# ============================================================
+# LLM
+# ============================================================
+@lru_cache(maxsize=4)
+def get_llm_with_tools(model_name: str):
+    """ChatGroq client with tools bound, built once per model and reused."""
+    llm = ChatGroq(model=model_name, temperature=0, streaming=True)
+    return llm.bind_tools([retrieve_documents])
 
 
 # ============================================================
@@ -103,12 +115,8 @@ def agent_node(state: AgentState):
     if not messages or not isinstance(messages[0], SystemMessage):
         messages = [SystemMessage(content=SYSTEM_PROMPT)] + messages
 
-    # Initialize LLM (8B model for lower token usage)
-    llm = ChatGroq(model="llama-3.1-8b-instant", temperature=0, streaming=True)
-
-    # Bind tools
-    tools = [retrieve_documents]
-    llm_with_tools = llm.bind_tools(tools)
+    # LLM with tools bound (8B model for lower token usage)
+    llm_with_tools = get_llm_with_tools("llama-3.1-8b-instant")
 
     response = llm_with_tools.invoke(messages)
     return {"messages": [response]}
@@ -140,12 +148,8 @@ def create_graph(model_name: str = "llama-3.1-8b-instant"):
         if not messages or not isinstance(messages[0], SystemMessage):
             messages = [SystemMessage(content=SYSTEM_PROMPT)] + messages
 
-        # Initialize LLM with selected model
-        llm = ChatGroq(model=model_name, temperature=0, streaming=True)
-
-        # Bind tools
-        tools = [retrieve_documents]
-        llm_with_tools = llm.bind_tools(tools)
+        # LLM with tools bound for the selected model
+        llm_with_tools = get_llm_with_tools(model_name)
 
         response = llm_with_tools.invoke(messages)
         return {"messages": [response]}
@@ -1,19 +1,36 @@
 from fastapi import FastAPI, UploadFile, File, HTTPException
 from fastapi.responses import StreamingResponse
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
 from typing import List, Optional, Dict, Any
 import os
-import json
 import asyncio
 import shutil
+import orjson
 
 from app.backend.services.ingest import DocumentProcessor
-from app.backend.services.vector_db import VectorStoreManager
+from app.backend.services.vector_db import get_vector_store_manager
 from app.backend.graph import create_graph
 from langchain_core.messages import HumanMessage, AIMessage
 
 app = FastAPI()
 
+# Graphs are compiled once at startup and shared across requests
+COMPILED_GRAPHS = {
+    model: create_graph(model_name=model)
+    for model in ["llama-3.1-8b-instant", "llama-3.3-70b-versatile"]
+}
+
+# Pre-encoded NDJSON framing for the hot streaming events; only the content
+# itself is serialized per chunk.
+_TOKEN_PREFIX = b'{"type":"token","content":'
+_TOOL_LOG_PREFIX = b'{"type":"tool_log","content":'
+_EVENT_SUFFIX = b"}\n"
+
+# /ask-batch limits: questions accepted per request, and how many of them run
+# through the graph (and hit the LLM / embedding APIs) at the same time
+MAX_BATCH_QUESTIONS = int(os.getenv("MAX_BATCH_QUESTIONS", "10"))
+BATCH_CONCURRENCY = int(os.getenv("BATCH_CONCURRENCY", "3"))
+
 
 class ChatRequest(BaseModel):
     question: str
@@ -21,6 +38,12 @@ class ChatRequest(BaseModel):
     model_name: str = "llama-3.1-8b-instant"
 
 
+class BatchChatRequest(BaseModel):
+    questions: List[str] = Field(..., min_length=1, max_length=MAX_BATCH_QUESTIONS)
+    chat_history: List[Dict[str, str]] = []
+    model_name: str = "llama-3.1-8b-instant"
+
+
 @app.post("/ingest")
 async def ingest_document(file: UploadFile = File(...)):
     # Create temp directory if not exists
@@ -36,16 +59,22 @@ async def ingest_document(file: UploadFile = File(...)):
         text, docs = processor.process(temp_path)
 
         # Add to Chroma
-        v_mgr = VectorStoreManager()
+        v_mgr = get_vector_store_manager()
         added = v_mgr.add_documents(docs)
 
+        # Same bytes already loaded: chunks (and citations) keep the original
+        # filename, so report that one rather than the name of this upload
+        filename = file.filename
+        if not added:
+            filename = v_mgr.stored_source(processor.file_hash) or filename
+
         # Generate Onboarding Questions
         starter_qs = processor.generate_starter_questions()
 
         return {
             "status": "success",
             "message": "File processed successfully",
-            "filename": file.filename,
+            "filename": filename,
             "starter_questions": starter_qs,
             "cached": not added,
         }
@@ -60,15 +89,16 @@ async def ingest_document(file: UploadFile = File(...)):
 async def get_document_info():
     """Get info about the currently loaded document, including starter questions."""
     try:
-        v_mgr = VectorStoreManager()
+        v_mgr = get_vector_store_manager()
         # Get first document's metadata to find the source filename
         result = v_mgr.collection.peek(limit=3)  # Get 3 chunks for starter Qs
 
         if result and result["metadatas"] and len(result["metadatas"]) > 0:
             source = result["metadatas"][0].get("source", None)
+            file_hash = result["metadatas"][0].get("file_hash", None)
             count = v_mgr.collection.count()
 
-            # Generate starter questions from existing chunks
+            # Generate starter questions from existing chunks (cached per file_hash)
             starter_questions = []
             if result["documents"]:
                 from app.backend.services.ingest import DocumentProcessor
@@ -80,7 +110,7 @@ async def get_document_info():
                 processor.chunks = [
                     Document(page_content=doc) for doc in result["documents"]
                 ]
-                starter_questions = processor.generate_starter_questions()
+                starter_questions = processor.generate_starter_questions(file_hash)
 
             return {
                 "has_document": True,
@@ -107,93 +137,136 @@ async def get_document_info():
 async def clear_document():
     """Delete all documents from the collection."""
     try:
-        v_mgr = VectorStoreManager()
-        v_mgr.client.delete_collection("pdf_rag_collection")
-        return {"status": "success", "message": "Document cleared"}
+        v_mgr = get_vector_store_manager()
+        if v_mgr.clear():
+            return {"status": "success", "message": "Document cleared"}
+        return {"status": "success", "message": "Collection already empty"}
     except Exception as e:
         return {"status": "success", "message": "Collection already empty"}
 
 
-@app.post("/ask")
-async def ask_question(req: ChatRequest):
-    graph = create_graph(model_name=req.model_name)
+def _get_graph(model_name: str):
+    return COMPILED_GRAPHS.get(model_name) or create_graph(model_name=model_name)
+
 
-    # Reconstruct history
+def _build_messages(chat_history: List[Dict[str, str]], question: str) -> list:
+    """Reconstruct LangChain messages from the client's chat history."""
     messages = []
-    for msg in req.chat_history:
+    for msg in chat_history:
         if msg["role"] == "user":
             messages.append(HumanMessage(content=msg["content"]))
         else:
             messages.append(AIMessage(content=msg["content"]))
 
-    messages.append(HumanMessage(content=req.question))
+    messages.append(HumanMessage(content=question))
+    return messages
+
+
+async def _stream_events(graph, messages: list):
+    """Run the graph and yield (event_type, content) pairs for the client."""
+    # Use astream_events to get granular updates (tokens & tool status)
+    try:
+        async for event in graph.astream_events({"messages": messages}, version="v1"):
+            event_type = event["event"]
+
+            # 1. Tool Call Start (Glass Box: "Searching...")
+            if event_type == "on_tool_start":
+                tool_input = event["data"].get("input", "")
+                yield "status", f"🔍 Searching: {event['name']} ({tool_input})..."
+
+            # 2. Chat Model Stream (Tokens)
+            elif event_type == "on_chat_model_stream":
+                chunk = event["data"]["chunk"]
+
+                # A. Content Tokens (Text)
+                content = ""
+                if hasattr(chunk, "content"):
+                    if isinstance(chunk.content, str):
+                        content = chunk.content
+                    elif isinstance(chunk.content, list):
+                        for part in chunk.content:
+                            if isinstance(part, dict) and "text" in part:
+                                content += part["text"]
+
+                if content:
+                    yield "token", content
+
+                # B. Tool Call Chunks (Streaming Args)
+                if hasattr(chunk, "tool_call_chunks") and chunk.tool_call_chunks:
+                    for tc_chunk in chunk.tool_call_chunks:
+                        if tc_chunk.get("args"):
+                            yield "tool_log", tc_chunk["args"]
+
+            # 3. Tool End (Glass Box: "Found info")
+            elif event_type == "on_tool_end":
+                yield "status", "✅ Found relevant documents."
+
+    except Exception as e:
+        yield "error", str(e)
+
+
+@app.post("/ask")
+async def ask_question(req: ChatRequest):
+    graph = _get_graph(req.model_name)
+    messages = _build_messages(req.chat_history, req.question)
 
     async def event_generator():
-        # Use astream_events to get granular updates (tokens & tool status)
-        try:
-            async for event in graph.astream_events(
-                {"messages": messages}, version="v1"
-            ):
-                event_type = event["event"]
-
-                # 1. Tool Call Start (Glass Box: "Searching...")
-                if event_type == "on_tool_start":
-                    tool_input = event["data"].get("input", "")
-                    yield (
-                        json.dumps(
-                            {
-                                "type": "status",
-                                "content": f"🔍 Searching: {event['name']} ({tool_input})...",
-                            }
-                        )
-                        + "\n"
-                    )
-
-                # 2. Chat Model Stream (Tokens)
-                elif event_type == "on_chat_model_stream":
-                    chunk = event["data"]["chunk"]
-
-                    # A. Content Tokens (Text)
-                    content = ""
-                    if hasattr(chunk, "content"):
-                        if isinstance(chunk.content, str):
-                            content = chunk.content
-                        elif isinstance(chunk.content, list):
-                            for part in chunk.content:
-                                if isinstance(part, dict) and "text" in part:
-                                    content += part["text"]
-
-                    if content:
-                        yield (json.dumps({"type": "token", "content": content}) + "\n")
-
-                    # B. Tool Call Chunks (Streaming Args)
-                    if hasattr(chunk, "tool_call_chunks") and chunk.tool_call_chunks:
-                        for tc_chunk in chunk.tool_call_chunks:
-                            if tc_chunk.get("args"):
-                                yield (
-                                    json.dumps(
-                                        {
-                                            "type": "tool_log",
-                                            "content": tc_chunk["args"],
-                                        }
-                                    )
-                                    + "\n"
-                                )  # else:
-                #     print(f"DEBUG: Event {event_type}")
-
-                # 3. Tool End (Glass Box: "Found info")
-                elif event_type == "on_tool_end":
-                    yield (
-                        json.dumps(
-                            {
-                                "type": "status",
-                                "content": "✅ Found relevant documents.",
-                            }
-                        )
-                        + "\n"
-                    )
+        async for event_type, content in _stream_events(graph, messages):
+            if event_type == "token":
+                yield _TOKEN_PREFIX + orjson.dumps(content) + _EVENT_SUFFIX
+            elif event_type == "tool_log":
+                yield _TOOL_LOG_PREFIX + orjson.dumps(content) + _EVENT_SUFFIX
+            else:
+                yield orjson.dumps({"type": event_type, "content": content}) + b"\n"
 
+    return StreamingResponse(event_generator(), media_type="text/event-stream")
+
+
+@app.post("/ask-batch")
+async def ask_batch(req: BatchChatRequest):
+    """
+    Answer several questions concurrently. Events from all queries are
+    interleaved on one stream, each tagged with the question's "query_idx".
+    """
+    graph = _get_graph(req.model_name)
+    # Build every message list up front, so bad input fails the request like /ask
+    batch_messages = [_build_messages(req.chat_history, q) for q in req.questions]
+    queue: asyncio.Queue = asyncio.Queue()
+    limiter = asyncio.Semaphore(BATCH_CONCURRENCY)
+
+    def encode(idx: int, event_type: str, content) -> bytes:
+        return (
+            orjson.dumps({"type": event_type, "content": content, "query_idx": idx})
+            + b"\n"
+        )
+
+    async def run_query(idx: int, messages: list):
+        try:
+            async with limiter:
+                async for event_type, content in _stream_events(graph, messages):
+                    await queue.put(encode(idx, event_type, content))
         except Exception as e:
-            yield json.dumps({"type": "error", "content": str(e)}) + "\n"
+            # Report it on the stream rather than letting the query vanish
+            await queue.put(encode(idx, "error", str(e)))
+        finally:
+            await queue.put(None)  # Marks this query as finished
+
+    async def event_generator():
+        tasks = [
+            asyncio.create_task(run_query(idx, messages))
+            for idx, messages in enumerate(batch_messages)
+        ]
+        try:
+            pending = len(tasks)
+            while pending:
+                item = await queue.get()
+                if item is None:
+                    pending -= 1
+                else:
+                    yield item
+        finally:
+            # Client disconnected or stream finished: stop any running queries
+            for task in tasks:
+                task.cancel()
 
     return StreamingResponse(event_generator(), media_type="text/event-stream")
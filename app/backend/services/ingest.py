@@ -1,15 +1,25 @@
-import pdfplumber
 import hashlib
+import orjson
 from collections import Counter
 from langchain_text_splitters import RecursiveCharacterTextSplitter
 from langchain_groq import ChatGroq
+from app.backend.services.pdf_extract import extract_all_pages
 import os
+import tempfile
+
+# Generated starter questions are cached per document (keyed by file_hash), under
+# the same private cache root as the BM25 index: the cached strings are rendered
+# in the UI, so other local users must not be able to plant them
+STARTER_CACHE_DIR = os.path.expanduser(
+    os.getenv("STARTER_CACHE_DIR", "~/.cache/rag-knowledge-engine/starter")
+)
 
 
 class DocumentProcessor:
     def __init__(self):
         self.chunks = []
         self.starter_questions = []
+        self.file_hash = None
 
     def process(self, file_path: str):
         """
@@ -17,102 +27,35 @@ class DocumentProcessor:
         Returns: (full_text, chunks_with_metadata)
         """
         all_text = ""
-        pages_content = []  # List of text per page
 
-        # Calculate Hash
+        # Calculate Hash (streamed, so the PDF is never fully loaded into memory)
         with open(file_path, "rb") as f:
-            file_hash = hashlib.md5(f.read()).hexdigest()
-
-        with pdfplumber.open(file_path) as pdf:
-            for i, page in enumerate(pdf.pages):
-                # 1. Extract Tables with structured column:value format
-                tables = page.extract_tables()
-                table_text = ""
-                if tables:
-                    for table in tables:
-                        # Check if table has a header row (first row with text)
-                        if len(table) < 2:
-                            continue
-
-                        # First row is assumed to be headers
-                        headers = [
-                            str(cell).strip() if cell else "" for cell in table[0]
-                        ]
-
-                        # Skip if no valid headers
-                        if not any(headers):
-                            # Fallback to simple markdown
-                            clean_table = [
-                                [str(cell) if cell else "" for cell in row]
-                                for row in table
-                            ]
-                            table_text += (
-                                "\n"
-                                + "\n".join(
-                                    [
-                                        "| " + " | ".join(row) + " |"
-                                        for row in clean_table
-                                    ]
-                                )
-                                + "\n"
-                            )
-                            continue
-
-                        # Process each data row with column:value format
-                        for row in table[1:]:  # Skip header row
-                            cells = [str(cell).strip() if cell else "" for cell in row]
-                            if not any(cells):  # Skip empty rows
-                                continue
-
-                            # Build structured string: "Col1: Val1 | Col2: Val2 | ..."
-                            parts = []
-                            for header, cell in zip(headers, cells):
-                                if header and cell:
-                                    parts.append(f"{header}: {cell}")
-
-                            if parts:
-                                table_text += "\n" + " | ".join(parts) + "\n"
-
-                # 2. Extract Text
-                raw_text = page.extract_text() or ""
-
-                # Combine
-                page_combined = raw_text + table_text
-                pages_content.append(page_combined)
+            file_hash = hashlib.file_digest(f, "md5").hexdigest()
+        self.file_hash = file_hash
+
+        # Reuse starter questions already generated for this exact file
+        self.starter_questions = self._load_cached_questions(file_hash)
+
+        # 1-2. Extract tables + text per page (parallel for larger PDFs)
+        pages_content = extract_all_pages(file_path)
 
         # 3. Frequency Analysis (Dynamic Cleaning)
-        bad_lines = self._analyze_frequencies(pages_content)
+        bad_lines, page_lines = self._analyze_frequencies(pages_content)
 
         clean_pages = []
-        for i, page_text in enumerate(pages_content):
-            clean_text = self._clean_text(page_text, bad_lines)
+        for lines in page_lines:
+            clean_text = self._clean_text(lines, bad_lines)
             clean_pages.append(clean_text)
             all_text += clean_text + "\n"
 
-        # 4. Chunking
+        # 4. Chunking (per page, so each chunk keeps its page number)
         splitter = RecursiveCharacterTextSplitter(chunk_size=1000, chunk_overlap=100)
-        self.chunks = splitter.create_documents(
-            clean_pages
-        )  # This loses page numbers if we aren't careful
-
-        # Let's do manual chunking to keep metadata?
-        # Actually langchain's create_documents accepts metadatas list.
-        # But for simplicity in this MVP, let's just use the splitter on the full text
-        # OR split per page to keep page numbers.
-
-        docs = []
-        for i, page_text in enumerate(clean_pages):
-            page_docs = splitter.create_documents(
-                [page_text],
-                metadatas=[
-                    {
-                        "page": i + 1,
-                        "source": os.path.basename(file_path),
-                        "file_hash": file_hash,
-                    }
-                ],
-            )
-            docs.extend(page_docs)
+        source = os.path.basename(file_path)
+        metadatas = [
+            {"page": i + 1, "source": source, "file_hash": file_hash}
+            for i in range(len(clean_pages))
+        ]
+        docs = splitter.create_documents(clean_pages, metadatas=metadatas)
 
         self.chunks = docs
 
@@ -122,17 +65,20 @@ class DocumentProcessor:
 
         return all_text, docs
 
-    def _analyze_frequencies(self, pages: list[str]) -> set[str]:
+    def _analyze_frequencies(
+        self, pages: list[str]
+    ) -> tuple[set[str], list[list[str]]]:
         """
         Detect lines that appear on > 80% of pages.
+        Returns (bad_lines, per-page line lists) so callers don't re-split the pages.
         """
+        page_lines = [page.split("\n") for page in pages]
         if len(pages) < 3:
-            return set()
+            return set(), page_lines
 
         line_counts = Counter()
-        for page in pages:
-            lines = set(page.split("\n"))  # Unique lines per page
-            line_counts.update(lines)
+        for lines in page_lines:
+            line_counts.update(set(lines))  # Unique lines per page
 
         threshold = len(pages) * 0.8
         bad_lines = {
@@ -140,17 +86,56 @@ class DocumentProcessor:
             for line, count in line_counts.items()
             if count > threshold and len(line.strip()) > 5
         }
-        return bad_lines
+        return bad_lines, page_lines
 
-    def _clean_text(self, text: str, bad_lines: set[str]) -> str:
-        lines = text.split("\n")
-        good_lines = [line for line in lines if line not in bad_lines]
-        return "\n".join(good_lines)
+    def _clean_text(self, lines: list[str], bad_lines: set[str]) -> str:
+        return "\n".join(line for line in lines if line not in bad_lines)
 
-    def generate_starter_questions(self):
+    def _starter_cache_path(self, file_hash: str) -> str:
+        return os.path.join(STARTER_CACHE_DIR, f"starter_{file_hash}.json")
+
+    @staticmethod
+    def _is_question_list(data) -> bool:
+        return isinstance(data, list) and all(isinstance(q, str) for q in data)
+
+    def _load_cached_questions(self, file_hash: str) -> list[str]:
+        try:
+            with open(self._starter_cache_path(file_hash), "rb") as f:
+                data = orjson.loads(f.read())
+        except (OSError, ValueError):
+            return []
+        return data if self._is_question_list(data) else []
+
+    def _save_cached_questions(self, file_hash: str, questions: list[str]):
+        """Write the cache via a temp file + rename, so readers never see a partial file."""
+        cache_path = self._starter_cache_path(file_hash)
+        tmp_path = None
+        try:
+            os.makedirs(STARTER_CACHE_DIR, mode=0o700, exist_ok=True)
+            with tempfile.NamedTemporaryFile(
+                dir=STARTER_CACHE_DIR, suffix=".tmp", delete=False
+            ) as f:
+                tmp_path = f.name
+                f.write(orjson.dumps(questions))
+            os.replace(tmp_path, cache_path)
+        except OSError as e:
+            print(f"Could not write starter question cache {cache_path}: {e}")
+            if tmp_path and os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    def generate_starter_questions(self, file_hash: str | None = None):
         """
         Generate 3 questions based on random chunks.
+        Results are cached per file_hash, so reloading a document skips the LLM call.
         """
+        file_hash = file_hash or self.file_hash
+        if file_hash == self.file_hash and self.starter_questions:
+            return self.starter_questions
+        if file_hash:
+            cached = self._load_cached_questions(file_hash)
+            if cached:
+                return cached
+
         if not self.chunks:
             return []
 
@@ -168,16 +153,21 @@ class DocumentProcessor:
 
         try:
             response = llm.invoke(prompt)
-            import json
 
             # Heuristic cleanup if model returns markdown code block
             content = response.content.strip()
             if "```" in content:
                 content = content.split("```")[1].replace("json", "").strip()
-            return json.loads(content)
+            questions = orjson.loads(content)
         except Exception:
             return [
                 "What is this document about?",
                 "Summarize the key points.",
                 "List specific details.",
             ]
+
+        # Only cache well-formed output (what _load_cached_questions accepts)
+        if file_hash and self._is_question_list(questions):
+            self._save_cached_questions(file_hash, questions)
+        self.starter_questions = questions
+        return questions
@@ -6,10 +6,19 @@ for more robust retrieval. Discovered need for hybrid search when
 "multi agent systems" failed to match "multi-agent systems" in vector-only search.
 """
 
+import asyncio
+import bm25s
 import chromadb
+import glob
+import hashlib
 import os
+import pickle
+import re
+import tempfile
+import threading
 import uuid
-import time
+from collections import OrderedDict
+from functools import lru_cache
 from langchain_google_genai import GoogleGenerativeAIEmbeddings
 from langchain_core.documents import Document
 from typing import List, Dict
@@ -17,9 +26,76 @@ from tenacity import (
     retry,
     stop_after_attempt,
     wait_exponential,
-    retry_if_exception_type,
+    retry_if_exception,
 )
-from rank_bm25 import BM25Okapi
+from google.api_core.exceptions import ResourceExhausted
+
+# On-disk BM25 cache, keyed by corpus signature. Bump the version whenever the
+# pickled index format or tokenization changes. The directory must be private
+# to this app: cached indexes are unpickled, so anyone who can write there can
+# run code in the backend.
+BM25_CACHE_DIR = os.path.expanduser(
+    os.getenv("BM25_CACHE_DIR", "~/.cache/rag-knowledge-engine/bm25")
+)
+_BM25_CACHE_VERSION = 7
+
+# BM25 tokenizer: Unicode word runs (so non-English text still tokenizes), minus
+# a deliberately small stopword list so short acronyms and model numbers still match.
+_TOKEN_RE = re.compile(r"\w+")
+_STOPWORDS = frozenset(
+    """a an and are as at be by for from has have in is it its of on or that
+    the this to was were will with what which who how""".split()
+)
+
+# LRU cache for query embeddings (set QUERY_EMBED_CACHE=0 to disable)
+QUERY_EMBED_CACHE = os.getenv("QUERY_EMBED_CACHE", "1") != "0"
+QUERY_EMBED_CACHE_SIZE = 2048
+
+# Opt-in: answer obviously lexical / obviously semantic queries from a single
+# retriever instead of always running both (set HYBRID_FAST_PATH=1)
+HYBRID_FAST_PATH = os.getenv("HYBRID_FAST_PATH", "0") == "1"
+
+
+def _tokenize(text: str) -> List[str]:
+    """Tokenize text for BM25 (used at both index and query time)."""
+    return [
+        t for t in _TOKEN_RE.findall(text.lower()) if t not in _STOPWORDS and len(t) > 1
+    ]
+
+
+def _fast_path_retriever(query: str) -> str | None:
+    """
+    Pick a single retriever when the other is unlikely to help:
+    short keyword queries -> "bm25", long plain-prose queries -> "vector".
+    Returns None when both should run (or the fast path is disabled).
+    """
+    if not HYBRID_FAST_PATH:
+        return None
+
+    tokens = query.split()
+    if 0 < len(tokens) <= 3 and all(len(t) < 12 for t in tokens):
+        return "bm25"
+
+    # Capitalized names or numbers (model numbers, specs) favour exact matching;
+    # the first word is skipped since questions start with a capital anyway
+    if len(tokens) > 12 and not any(
+        t[0].isupper() or any(c.isdigit() for c in t) for t in tokens[1:]
+    ):
+        return "vector"
+    return None
+
+
+def _is_rate_limit_error(exc: BaseException) -> bool:
+    """True if exc (or an exception it wraps) is a Gemini 429 / quota error."""
+    while exc is not None:
+        if isinstance(exc, ResourceExhausted):
+            return True
+        if 429 in (getattr(exc, "code", None), getattr(exc, "status_code", None)):
+            return True
+        if "RESOURCE_EXHAUSTED" in str(exc):
+            return True
+        exc = exc.__cause__ or exc.__context__
+    return False
 
 
 class VectorStoreManager:
@@ -38,35 +114,63 @@ class VectorStoreManager:
         self.embedder_query = GoogleGenerativeAIEmbeddings(
             model="models/gemini-embedding-001", task_type="RETRIEVAL_QUERY"
         )
+        # Query embedding LRU: stripped query -> vector (tuple)
+        self._query_vectors = OrderedDict()
+        self._query_vectors_lock = threading.Lock()
 
-        # BM25 index (rebuilt on each query from ChromaDB data)
-        self._bm25_index = None
-        self._bm25_docs = []
+        # BM25 state (loaded lazily from the on-disk cache, or rebuilt from ChromaDB):
+        # None or an (index, ids, texts, metas) tuple, always replaced as a whole so
+        # searches on worker threads see a consistent snapshot. The corpus is kept
+        # as raw parallel lists; Documents are only built for hits.
+        self._bm25 = None
+        self._bm25_lock = threading.Lock()
 
     @retry(
         stop=stop_after_attempt(5),
         wait=wait_exponential(multiplier=1, min=4, max=60),
-        retry=retry_if_exception_type(Exception),
+        retry=retry_if_exception(_is_rate_limit_error),
+        reraise=True,
     )
     def _embed_with_retry(self, texts):
         return self.embedder_ingest.embed_documents(texts)
 
+    def clear(self) -> bool:
+        """
+        Delete the collection and start over with an empty one.
+        Returns True if an existing collection was deleted.
+        """
+        try:
+            self.client.delete_collection("pdf_rag_collection")
+            deleted = True
+        except Exception:
+            deleted = False
+        self.collection = self.client.get_or_create_collection("pdf_rag_collection")
+        self._invalidate_bm25_cache()
+        return deleted
+
     def add_documents(self, documents: List[Document]) -> bool:
         """
         Embeds and stores documents. Clears existing collection for single-document mode.
+        Returns False without re-embedding if the same file (by file_hash) is already
+        loaded. The stored chunks are left untouched in that case, so they keep the
+        "source" of the first upload even if the file was re-uploaded under a new
+        name; use stored_source() to report the name citations will show.
         """
         if not documents:
             return False
 
+        # Skip re-ingestion if this exact file (by hash) is already in the collection
+        file_hash = documents[0].metadata.get("file_hash")
+        if file_hash:
+            existing = self.collection.get(where={"file_hash": file_hash}, limit=1)
+            if existing["ids"]:
+                return False
+
         # Clear existing collection (single-document mode)
-        try:
-            self.client.delete_collection("pdf_rag_collection")
-        except Exception:
-            pass
-        self.collection = self.client.get_or_create_collection("pdf_rag_collection")
+        self.clear()
 
         # Process in Batches
-        batch_size = 10
+        batch_size = 100
         all_embeddings = []
         all_ids = []
         all_metadatas = []
@@ -82,7 +186,6 @@ class VectorStoreManager:
                 all_texts.extend(batch_texts)
                 all_ids.extend([str(uuid.uuid4()) for _ in batch])
                 all_metadatas.extend([doc.metadata for doc in batch])
-                time.sleep(2.0)  # Rate limit
             except Exception as e:
                 print(f"Error embedding batch {i}: {e}")
                 raise e
@@ -95,62 +198,179 @@ class VectorStoreManager:
                 ids=all_ids,
             )
             # Reset BM25 index so it rebuilds on next query
-            self._bm25_index = None
+            self._invalidate_bm25_cache()
             return True
 
         return False
 
+    def stored_source(self, file_hash: str) -> str | None:
+        """Return the "source" (filename) stored with the chunks of file_hash, if loaded."""
+        existing = self.collection.get(
+            where={"file_hash": file_hash}, limit=1, include=["metadatas"]
+        )
+        metas = existing.get("metadatas") or [{}]
+        return (metas[0] or {}).get("source")
+
+    def _corpus_signature(self) -> str | None:
+        """Cheap fingerprint of the collection: file_hash of the loaded document + chunk count."""
+        count = self.collection.count()
+        if not count:
+            return None
+
+        sample = self.collection.peek(limit=1)
+        metas = sample.get("metadatas") or [{}]
+        file_hash = (metas[0] or {}).get("file_hash") or sample["ids"][0]
+        return f"{file_hash}_{count}"
+
+    def _bm25_cache_path(self, signature: str) -> str:
+        return os.path.join(
+            BM25_CACHE_DIR, f"bm25_v{_BM25_CACHE_VERSION}_{signature}.pkl"
+        )
+
+    def _invalidate_bm25_cache(self):
+        """Drop the in-memory index and any pickled indexes on disk."""
+        with self._bm25_lock:
+            self._bm25 = None
+            for path in glob.glob(os.path.join(BM25_CACHE_DIR, "bm25_v*_*.pkl")):
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+
+    def _get_bm25(self):
+        """Return the current BM25 state, building it once if needed."""
+        state = self._bm25
+        if state is not None:
+            return state
+
+        # Double-checked: concurrent cold queries wait for a single build
+        with self._bm25_lock:
+            if self._bm25 is None:
+                self._bm25 = self._build_bm25_index()
+            return self._bm25
+
     def _build_bm25_index(self):
-        """Build BM25 index from all documents in ChromaDB."""
-        # Get all documents from collection
+        """
+        Load the BM25 index from the disk cache, or build it from ChromaDB.
+        Returns (index, ids, texts, metas), or None for an empty collection.
+        """
+        signature = self._corpus_signature()
+        if signature is None:
+            return None
+
+        cache_path = self._bm25_cache_path(signature)
+        try:
+            with open(cache_path, "rb") as f:
+                index, ids, texts, metas = pickle.load(f)
+            return index, ids, texts, metas
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            # Unreadable or incompatible (e.g. pickled by another bm25s version):
+            # drop it and rebuild rather than failing every search
+            print(f"Discarding BM25 cache {cache_path}: {e!r}")
+            try:
+                os.remove(cache_path)
+            except OSError:
+                pass
+
+        # Cache miss: get all documents from collection
         all_data = self.collection.get(include=["documents", "metadatas"])
 
         if not all_data["documents"]:
-            self._bm25_docs = []
-            self._bm25_index = None
-            return
+            return None
 
-        self._bm25_docs = [
-            Document(page_content=text, metadata=meta)
-            for text, meta in zip(all_data["documents"], all_data["metadatas"])
-        ]
+        ids = all_data["ids"]
+        texts = all_data["documents"]
+        metas = all_data["metadatas"]
 
         # Tokenize documents for BM25
-        tokenized_docs = [doc.page_content.lower().split() for doc in self._bm25_docs]
-        self._bm25_index = BM25Okapi(tokenized_docs)
+        index = bm25s.BM25()
+        index.index([_tokenize(text) for text in texts], show_progress=False)
+        state = (index, ids, texts, metas)
+
+        # Write to a temp file and rename, so readers never see a partial pickle
+        tmp_path = None
+        try:
+            os.makedirs(BM25_CACHE_DIR, mode=0o700, exist_ok=True)
+            with tempfile.NamedTemporaryFile(
+                dir=BM25_CACHE_DIR, suffix=".tmp", delete=False
+            ) as f:
+                tmp_path = f.name
+                pickle.dump(state, f)
+            os.replace(tmp_path, cache_path)
+        except (OSError, pickle.PicklingError) as e:
+            print(f"Could not write BM25 cache {cache_path}: {e}")
+            if tmp_path and os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+        return state
 
     def _bm25_search(self, query: str, k: int = 4) -> List[tuple]:
         """Keyword search using BM25. Returns list of (doc, score)."""
-        if self._bm25_index is None:
-            self._build_bm25_index()
+        state = self._get_bm25()
+        if state is None:
+            return []
+        index, ids, texts, metas = state
 
-        if not self._bm25_docs:
+        # Unknown terms cannot match anything; drop them before querying
+        vocab = index.vocab_dict
+        tokenized_query = [t for t in _tokenize(query) if t in vocab]
+        if not tokenized_query:
             return []
 
-        tokenized_query = query.lower().split()
-        scores = self._bm25_index.get_scores(tokenized_query)
+        # bm25s scores with sparse-matrix ops and returns the top k directly
+        top_indices, scores = index.retrieve(
+            [tokenized_query], k=min(k, len(texts)), show_progress=False
+        )
 
-        # Get top k indices
-        top_indices = sorted(range(len(scores)), key=lambda i: scores[i], reverse=True)[
-            :k
+        return [
+            (
+                Document(id=ids[i], page_content=texts[i], metadata=metas[i]),
+                float(score),
+            )
+            for i, score in zip(top_indices[0], scores[0])
+            if score > 0
         ]
 
-        return [(self._bm25_docs[i], scores[i]) for i in top_indices if scores[i] > 0]
+    def _embed_query(self, query: str) -> List[float]:
+        """
+        Embed a search query, reusing cached vectors for repeated queries.
+        Only surrounding whitespace is stripped; case is kept (so "IT" and "it"
+        stay distinct), which makes cached and uncached vectors identical.
+        """
+        key = query.strip()
+        if not QUERY_EMBED_CACHE:
+            return self.embedder_query.embed_query(key)
+
+        with self._query_vectors_lock:
+            vector = self._query_vectors.get(key)
+            if vector is not None:
+                self._query_vectors.move_to_end(key)
+                return list(vector)
+
+        vector = tuple(self.embedder_query.embed_query(key))
+        with self._query_vectors_lock:
+            self._query_vectors[key] = vector
+            if len(self._query_vectors) > QUERY_EMBED_CACHE_SIZE:
+                self._query_vectors.popitem(last=False)
+        return list(vector)
 
     def similarity_search(self, query: str, k: int = 4) -> List[Document]:
         """Pure vector similarity search."""
-        query_vector = self.embedder_query.embed_query(query)
+        query_vector = self._embed_query(query)
         results = self.collection.query(query_embeddings=[query_vector], n_results=k)
 
         if not results or not results["documents"]:
             return []
 
         found_docs = []
+        batch_ids = results["ids"][0]
         batch_docs = results["documents"][0]
         batch_metas = results["metadatas"][0]
 
-        for text, meta in zip(batch_docs, batch_metas):
-            found_docs.append(Document(page_content=text, metadata=meta))
+        for doc_id, text, meta in zip(batch_ids, batch_docs, batch_metas):
+            found_docs.append(Document(id=doc_id, page_content=text, metadata=meta))
 
         return found_docs
 
@@ -166,40 +386,95 @@ class VectorStoreManager:
             k: Number of results to return
             vector_weight: Weight for vector results (0-1), BM25 gets (1-vector_weight)
         """
+        fast_path = _fast_path_retriever(query)
+        if fast_path == "vector":
+            return self.similarity_search(query, k=k)
+        if fast_path == "bm25":
+            docs = [doc for doc, _ in self._bm25_search(query, k=k)]
+            if docs:
+                return docs
+
         # Get results from both methods
         vector_docs = self.similarity_search(query, k=k)
         bm25_results = self._bm25_search(query, k=k)
+        return self._fuse_results(vector_docs, bm25_results, k, vector_weight)
+
+    async def ahybrid_search(
+        self, query: str, k: int = 6, vector_weight: float = 0.5
+    ) -> List[Document]:
+        """
+        Async variant of hybrid_search. The vector search (network-bound) and the
+        BM25 search (CPU-bound) run concurrently in worker threads.
+        """
+        fast_path = _fast_path_retriever(query)
+        if fast_path == "vector":
+            return await asyncio.to_thread(self.similarity_search, query, k)
+        if fast_path == "bm25":
+            bm25_results = await asyncio.to_thread(self._bm25_search, query, k)
+            if bm25_results:
+                return [doc for doc, _ in bm25_results]
+
+        vector_docs, bm25_results = await asyncio.gather(
+            asyncio.to_thread(self.similarity_search, query, k),
+            asyncio.to_thread(self._bm25_search, query, k),
+        )
+        return self._fuse_results(vector_docs, bm25_results, k, vector_weight)
+
+    @staticmethod
+    def _doc_key(doc: Document) -> str:
+        """Stable fusion key: the Chroma id, or a digest of the full content."""
+        if doc.id:
+            return doc.id
+        return hashlib.blake2b(doc.page_content.encode("utf-8")).hexdigest()
+
+    def _fuse_results(
+        self,
+        vector_docs: List[Document],
+        bm25_results: List[tuple],
+        k: int,
+        vector_weight: float,
+    ) -> List[Document]:
+        """Merge vector and BM25 rankings with Reciprocal Rank Fusion."""
         bm25_docs = [doc for doc, _ in bm25_results]
 
         # Reciprocal Rank Fusion
         # Score = sum(1 / (rank + 60)) for each ranking
-        doc_scores: Dict[str, tuple] = {}  # content_hash -> (doc, score)
+        doc_scores: Dict[str, tuple] = {}  # doc_key -> (doc, score)
 
         # Score vector results
         for rank, doc in enumerate(vector_docs):
-            content_hash = hash(doc.page_content[:200])
+            doc_key = self._doc_key(doc)
             rrf_score = vector_weight * (1 / (rank + 60))
-            if content_hash in doc_scores:
-                doc_scores[content_hash] = (
+            if doc_key in doc_scores:
+                doc_scores[doc_key] = (
                     doc,
-                    doc_scores[content_hash][1] + rrf_score,
+                    doc_scores[doc_key][1] + rrf_score,
                 )
             else:
-                doc_scores[content_hash] = (doc, rrf_score)
+                doc_scores[doc_key] = (doc, rrf_score)
 
         # Score BM25 results
         bm25_weight = 1 - vector_weight
         for rank, doc in enumerate(bm25_docs):
-            content_hash = hash(doc.page_content[:200])
+            doc_key = self._doc_key(doc)
             rrf_score = bm25_weight * (1 / (rank + 60))
-            if content_hash in doc_scores:
-                doc_scores[content_hash] = (
+            if doc_key in doc_scores:
+                doc_scores[doc_key] = (
                     doc,
-                    doc_scores[content_hash][1] + rrf_score,
+                    doc_scores[doc_key][1] + rrf_score,
                 )
             else:
-                doc_scores[content_hash] = (doc, rrf_score)
+                doc_scores[doc_key] = (doc, rrf_score)
 
         # Sort by combined score and return top k
         sorted_docs = sorted(doc_scores.values(), key=lambda x: x[1], reverse=True)
         return [doc for doc, _ in sorted_docs[:k]]
+
+
+@lru_cache(maxsize=1)
+def get_vector_store_manager() -> VectorStoreManager:
+    """
+    Process-wide VectorStoreManager, so the Chroma client, embedders and
+    BM25 index survive across requests.
+    """
+    return VectorStoreManager()
@@ -5,8 +5,16 @@ Clean implementation with proper state management and streaming.
 
 import streamlit as st
 import requests
-import json
+import hashlib
 import os
+import queue
+import threading
+import time
+
+try:
+    from orjson import loads as json_loads, JSONDecodeError
+except ImportError:  # orjson is optional; fall back to stdlib json
+    from json import loads as json_loads, JSONDecodeError
 
 # ============================================================
 # CONFIGURATION
@@ -15,6 +23,23 @@ st.set_page_config(page_title="PDF AI Assistant", page_icon="🤖", layout="wide
 
 BACKEND_URL = os.getenv("BACKEND_URL", "http://localhost:8000")
 
+MODEL_OPTIONS = {
+    "⚡ Fast (8B)": "llama-3.1-8b-instant",
+    "🧠 Smart (70B)": "llama-3.3-70b-versatile",
+}
+_MODEL_KEYS = tuple(MODEL_OPTIONS)
+
+
+@st.cache_resource
+def get_http():
+    """Shared keep-alive session so backend calls reuse pooled connections."""
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_connections=4, pool_maxsize=8)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
 # ============================================================
 # CUSTOM STYLING
 # ============================================================
@@ -87,6 +112,15 @@ st.markdown(
 if "messages" not in st.session_state:
     st.session_state.messages = []
 
+if "clean_history" not in st.session_state:
+    # Role/content-only copy of messages, maintained incrementally for /ask
+    st.session_state.clean_history = []
+
+if "last_turn_key" not in st.session_state:
+    # Chained keys of the last two turns, used to drop duplicate appends
+    st.session_state.last_turn_key = ""
+    st.session_state.prev_turn_key = ""
+
 if "starter_questions" not in st.session_state:
     st.session_state.starter_questions = []
 
@@ -96,28 +130,92 @@ if "file_uploaded" not in st.session_state:
 if "document_filename" not in st.session_state:
     st.session_state.document_filename = None
 
+# Name of the upload last sent to /ingest. Can differ from document_filename:
+# re-uploading an already-loaded file under a new name keeps the stored name.
+if "ingested_upload" not in st.session_state:
+    st.session_state.ingested_upload = None
+
 if "selected_model" not in st.session_state:
     st.session_state.selected_model = "llama-3.1-8b-instant"
 
+
+def turn_key(role, content, prev):
+    """Short key for a chat turn, chained to the key of the turn before it."""
+    return hashlib.blake2b(
+        f"{role}|{content}|{prev}".encode(), digest_size=8
+    ).hexdigest()
+
+
+def add_message(role, content, **extra):
+    """Append a chat turn to both the displayed messages and the /ask history."""
+    # Skip exact repeats of the previous turn (e.g. a double-clicked follow-up)
+    if turn_key(role, content, st.session_state.prev_turn_key) == (
+        st.session_state.last_turn_key
+    ):
+        return
+    st.session_state.prev_turn_key = st.session_state.last_turn_key
+    st.session_state.last_turn_key = turn_key(
+        role, content, st.session_state.last_turn_key
+    )
+
+    if role == "assistant":
+        # Parse once here so history renders don't re-parse every rerun
+        extra["clean_content"], extra["followups"] = parse_followups(content)
+    st.session_state.messages.append({"role": role, "content": content, **extra})
+    st.session_state.clean_history.append({"role": role, "content": content})
+
+
+def reset_chat():
+    st.session_state.messages = []
+    st.session_state.clean_history = []
+    st.session_state.last_turn_key = ""
+    st.session_state.prev_turn_key = ""
+
+
+def submit_chat_input():
+    """on_submit callback for the chat box."""
+    if st.session_state.chat_input:
+        add_message("user", st.session_state.chat_input)
+
+
 # ============================================================
 # CHECK FOR EXISTING DOCUMENT ON PAGE LOAD
 # ============================================================
+@st.cache_data(ttl=60, show_spinner=False)
+def fetch_document_info():
+    """Cached /document-info probe; cleared whenever the document changes."""
+    resp = get_http().get(f"{BACKEND_URL}/document-info", timeout=5)
+    resp.raise_for_status()
+    return resp.json()
+
+
 if st.session_state.document_filename is None:
     try:
-        resp = requests.get(f"{BACKEND_URL}/document-info", timeout=5)
-        if resp.status_code == 200:
-            data = resp.json()
-            if data.get("has_document"):
-                st.session_state.document_filename = data.get("filename")
-                st.session_state.file_uploaded = True
-                # Also get starter questions
-                st.session_state.starter_questions = data.get("starter_questions", [])
+        data = fetch_document_info()
+        if data.get("has_document"):
+            st.session_state.document_filename = data.get("filename")
+            st.session_state.file_uploaded = True
+            # Also get starter questions
+            st.session_state.starter_questions = data.get("starter_questions", [])
     except Exception:
         pass
 
 # ============================================================
 # SIDEBAR: FILE UPLOAD
 # ============================================================
+def clear_document():
+    """on_click callback: delete the document from ChromaDB and reset the chat."""
+    try:
+        get_http().delete(f"{BACKEND_URL}/clear-document")
+    except Exception:
+        pass
+    st.session_state.file_uploaded = False
+    reset_chat()
+    st.session_state.starter_questions = []
+    st.session_state.document_filename = None
+    fetch_document_info.clear()
+
+
 with st.sidebar:
     st.header("📂 Upload Document")
     st.info("⚠️ Uploading a new file will replace the current document.", icon="ℹ️")
@@ -129,13 +227,13 @@ with st.sidebar:
     # Check if a NEW file is being uploaded (different from current)
     new_upload = uploaded_file and (
         not st.session_state.file_uploaded
-        or uploaded_file.name != st.session_state.document_filename
+        or uploaded_file.name != st.session_state.ingested_upload
     )
 
     if new_upload:
         with st.spinner("🔍 Analyzing document..."):
             try:
-                response = requests.post(
+                response = get_http().post(
                     f"{BACKEND_URL}/ingest", files={"file": uploaded_file}
                 )
                 if response.status_code == 200:
@@ -144,10 +242,11 @@ with st.sidebar:
                         "starter_questions", []
                     )
                     st.session_state.document_filename = data.get("filename")
+                    st.session_state.ingested_upload = uploaded_file.name
                     st.session_state.file_uploaded = True
-                    st.session_state.messages = []  # Clear chat for new doc
+                    reset_chat()  # Clear chat for new doc
+                    fetch_document_info.clear()
                     st.success("✅ Document ready!")
-                    st.rerun()
                 else:
                     st.error(f"Error: {response.text}")
             except Exception as e:
@@ -155,28 +254,14 @@ with st.sidebar:
 
     if st.session_state.file_uploaded and st.session_state.document_filename:
         st.success(f"📄 **{st.session_state.document_filename}**")
-        if st.button("🔄 Clear Document"):
-            # Delete from ChromaDB
-            try:
-                requests.delete(f"{BACKEND_URL}/clear-document")
-            except Exception:
-                pass
-            st.session_state.file_uploaded = False
-            st.session_state.messages = []
-            st.session_state.starter_questions = []
-            st.session_state.document_filename = None
-            st.rerun()
+        st.button("🔄 Clear Document", on_click=clear_document)
 
     # --- Model Selection ---
     st.divider()
-    MODEL_OPTIONS = {
-        "⚡ Fast (8B)": "llama-3.1-8b-instant",
-        "🧠 Smart (70B)": "llama-3.3-70b-versatile",
-    }
     st.session_state.selected_model = MODEL_OPTIONS[
         st.selectbox(
             "Select Model",
-            options=list(MODEL_OPTIONS.keys()),
+            options=_MODEL_KEYS,
             index=0 if st.session_state.selected_model == "llama-3.1-8b-instant" else 1,
         )
     ]
@@ -190,26 +275,84 @@ st.caption("Ask questions about your uploaded documents")
 
 
 # --- Helper: Parse Follow-up Questions ---
+FOLLOW_UP_PREFIX = "FOLLOW_UP:"
+FOLLOW_UP_PREFIX_LEN = len(FOLLOW_UP_PREFIX)
+
+
 def parse_followups(content):
-    """Extract FOLLOW_UP: lines and return (clean_content, followups_list)"""
-    lines = content.split("\n")
+    """Extract FOLLOW_UP: lines and return (clean_content, followups_tuple)"""
+    lines = content.splitlines()
     clean_lines = []
     followups = []
 
     for line in lines:
-        if line.strip().startswith("FOLLOW_UP:"):
-            question = line.strip().replace("FOLLOW_UP:", "").strip()
+        stripped = line.strip()
+        if stripped.startswith(FOLLOW_UP_PREFIX):
+            question = stripped[FOLLOW_UP_PREFIX_LEN:].strip()
             if question:
                 followups.append(question)
         else:
             clean_lines.append(line)
 
     # Remove trailing separator if present
-    clean_content = "\n".join(clean_lines).rstrip("-").rstrip()
-    return clean_content, followups
+    clean_content = "\n".join(clean_lines).rstrip("- \t\r\n")
+    return clean_content, tuple(followups)
+
+
+# --- Helper: Split NDJSON Stream ---
+def iter_ndjson_lines(response):
+    """Yield each NDJSON line (bytes) as soon as the socket delivers it."""
+    buf = bytearray()
+    for chunk in response.iter_content(chunk_size=None):
+        buf += chunk
+        while (i := buf.find(b"\n")) != -1:
+            line = bytes(buf[:i])
+            del buf[: i + 1]
+            if line:
+                yield line
+    if buf:
+        yield bytes(buf)
+
+
+# --- Helper: Background /ask Reader ---
+def stream_ask(session, payload, events, stop):
+    """
+    Read the /ask NDJSON stream on a worker thread and put parsed events on
+    the queue, so socket reads never wait on Streamlit rendering.
+    Puts None when the stream ends. Closes the stream early once `stop` is
+    set (the script pass that started it was rerun or stopped).
+    """
+    try:
+        with session.post(
+            f"{BACKEND_URL}/ask",
+            json=payload,
+            stream=True,
+            # (connect, read) timeouts so a stalled backend can't hang the reader
+            timeout=(3, 300),
+            # No compression: a gzip layer would buffer tokens before delivering them
+            headers={"Accept-Encoding": "identity", "Connection": "keep-alive"},
+        ) as response:
+            if response.status_code != 200:
+                events.put(
+                    {"type": "error", "content": f"Backend error: {response.status_code}"}
+                )
+                return
+
+            for line in iter_ndjson_lines(response):
+                if stop.is_set():
+                    break  # Leaving the `with` closes the response
+                try:
+                    events.put(json_loads(line))
+                except JSONDecodeError:
+                    pass
+    except Exception as e:
+        events.put({"type": "error", "content": f"Connection failed: {e}"})
+    finally:
+        events.put(None)
 
 
 # --- Display Chat History ---
+last_idx = len(st.session_state.messages) - 1
 for idx, msg in enumerate(st.session_state.messages):
     with st.chat_message(msg["role"]):
         # Show thinking process if available
@@ -218,18 +361,22 @@ for idx, msg in enumerate(st.session_state.messages):
                 for log in msg["thinking"]:
                     st.write(log)
 
-        # Parse and display content (without follow-up lines)
+        # Display content (without follow-up lines, pre-parsed in add_message)
         if msg["role"] == "assistant":
-            clean_content, followups = parse_followups(msg["content"])
-            st.markdown(clean_content)
+            followups = msg["followups"]
+            st.markdown(msg["clean_content"])
 
             # Show follow-up buttons for the LAST assistant message only
-            if followups and idx == len(st.session_state.messages) - 1:
+            if followups and idx == last_idx:
                 st.caption("**Follow-up questions:**")
                 for i, q in enumerate(followups):
-                    if st.button(q, key=f"followup_{idx}_{i}", type="secondary"):
-                        st.session_state.messages.append({"role": "user", "content": q})
-                        st.rerun()
+                    st.button(
+                        q,
+                        key=f"followup_{idx}_{i}",
+                        type="secondary",
+                        on_click=add_message,
+                        args=("user", q),
+                    )
         else:
             st.markdown(msg["content"])
 
@@ -240,16 +387,20 @@ if st.session_state.starter_questions and not st.session_state.messages:
 
     for i, question in enumerate(st.session_state.starter_questions):
         # Use a container for each question for better styling
-        if st.button(f"→ {question}", key=f"starter_{i}", use_container_width=True):
-            st.session_state.messages.append({"role": "user", "content": question})
-            st.rerun()
+        st.button(
+            f"→ {question}",
+            key=f"starter_{i}",
+            use_container_width=True,
+            on_click=add_message,
+            args=("user", question),
+        )
 
 # --- User Input ---
-user_input = st.chat_input("Ask about your document...")
-
-if user_input:
-    st.session_state.messages.append({"role": "user", "content": user_input})
-    st.rerun()
+# Callbacks run before the next script pass, so the new message is rendered
+# (and answered) in that same pass without an extra st.rerun()
+st.chat_input(
+    "Ask about your document...", key="chat_input", on_submit=submit_chat_input
+)
 
 # --- Generate Response (if last message is from user) ---
 if st.session_state.messages and st.session_state.messages[-1]["role"] == "user":
@@ -262,65 +413,78 @@ if st.session_state.messages and st.session_state.messages[-1]["role"] == "user"
         response_container = st.empty()
         full_response = ""
 
+        # Coalesce token renders: redraw every 50ms or 64 new chars
+        last_flush = time.monotonic()
+        pending_chars = 0
+
+        # Coalesce thinking updates: show the latest status at most every 100ms
+        last_thinking_flush = 0.0
+        pending_thinking = None
+
+        payload = {
+            "question": st.session_state.messages[-1]["content"],
+            # History without the current question (or thinking logs)
+            "chat_history": st.session_state.clean_history[:-1],
+            "model_name": st.session_state.selected_model,
+        }
+        events = queue.Queue()
+        stop = threading.Event()
+        threading.Thread(
+            target=stream_ask, args=(get_http(), payload, events, stop), daemon=True
+        ).start()
+
         try:
-            # Build clean chat history (exclude thinking logs)
-            clean_history = [
-                {"role": m["role"], "content": m["content"]}
-                for m in st.session_state.messages[:-1]
-            ]
-
-            with requests.post(
-                f"{BACKEND_URL}/ask",
-                json={
-                    "question": st.session_state.messages[-1]["content"],
-                    "chat_history": clean_history,
-                    "model_name": st.session_state.selected_model,
-                },
-                stream=True,
-            ) as response:
-                if response.status_code != 200:
-                    st.error(f"Backend error: {response.status_code}")
+            while True:
+                try:
+                    data = events.get(timeout=0.1)
+                except queue.Empty:
+                    data = {}  # Stream went quiet: flush whatever is pending below
+                if data is None:
+                    break
+                idle = not data
+                event_type = data.get("type")
+                content = data.get("content", "")
+                now = time.monotonic()
+
+                if event_type == "status":
+                    thinking_logs.append(content)
+                    pending_thinking = f"🧠 {content}"
+
+                elif event_type == "tool_log":
+                    thinking_logs.append(f"🛠️ {content}")
+                    pending_thinking = f"🛠️ Building query: {content}"
+
+                elif event_type == "token":
+                    full_response += content
+                    pending_chars += len(content)
+
+                elif event_type == "error":
+                    st.error(content)
                     st.stop()
 
-                for line in response.iter_lines():
-                    if line:
-                        try:
-                            data = json.loads(line.decode("utf-8"))
-                            event_type = data.get("type")
-                            content = data.get("content", "")
-
-                            if event_type == "status":
-                                thinking_logs.append(content)
-                                thinking_container.info(f"🧠 {content}")
-
-                            elif event_type == "tool_log":
-                                thinking_logs.append(f"🛠️ {content}")
-                                thinking_container.info(f"🛠️ Building query: {content}")
-
-                            elif event_type == "token":
-                                full_response += content
-                                response_container.markdown(full_response + "▌")
-
-                            elif event_type == "error":
-                                st.error(content)
-                                st.stop()
-
-                        except json.JSONDecodeError:
-                            pass
-
-                # Final update
-                thinking_container.empty()
-                response_container.markdown(full_response)
-
-                # Save to history
-                st.session_state.messages.append(
-                    {
-                        "role": "assistant",
-                        "content": full_response,
-                        "thinking": thinking_logs if thinking_logs else None,
-                    }
-                )
-                st.rerun()
-
-        except Exception as e:
-            st.error(f"Connection failed: {e}")
+                if pending_chars and (
+                    idle or pending_chars >= 64 or now - last_flush > 0.05
+                ):
+                    response_container.markdown(full_response + "▌")
+                    last_flush = now
+                    pending_chars = 0
+
+                if pending_thinking and (idle or now - last_thinking_flush > 0.1):
+                    thinking_container.info(pending_thinking)
+                    last_thinking_flush = now
+                    pending_thinking = None
+        finally:
+            # Rerun, st.stop() or normal end: tell the reader to drop the stream
+            stop.set()
+
+        # Final update
+        thinking_container.empty()
+        response_container.markdown(full_response)
+
+        # Save to history
+        add_message(
+            "assistant",
+            full_response,
+            thinking=thinking_logs if thinking_logs else None,
+        )
+        st.rerun()